@@ -105,6 +105,21 @@ def fib2(n):   # return Fibonacci series up to n
         a, b = b, a+b
     return result
 
+# If you also want the n-th number without building the series, add to fibo.py
+# the fast doubling function from 4.7 (see 04_2_functions.py, "a faster
+# Fibonacci engine"):
+
+def fib_pair(n):   # return (F(n), F(n+1)) in about log2(n) steps
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        c = a * (2*b - a)
+        d = a*a + b*b
+        if bit == '1':
+            a, b = d, c + d
+        else:
+            a, b = c, d
+    return a, b
+
 # Now enter the Python interpreter and import this module with the following command:
 
 import fibo
@@ -126,6 +141,153 @@ fib = fibo.fib
 fib(500)
 
 
+##### Going further: a shared cache for fibo.fib2 #####
+
+# Every call of fibo.fib2() starts again from 0 and 1. If a program asks many
+# times for series that overlap (fib2(100), then fib2(1000), then fib2(500)...),
+# the module can remember the longest series computed so far, a "prefix" of the
+# whole Fibonacci series, and extend it only when a bigger bound arrives. A
+# smaller bound is just a slice of the cached prefix, found with bisect.
+
+# To keep the memory bounded, the cache never stores more than MAX_CACHED
+# numbers: the numbers after that are computed again starting from the last
+# cached pair. Fibonacci numbers grow fast (F(k) has about 0.7*k bits), so the
+# memory of the cache grows with the SQUARE of MAX_CACHED: 10**4 numbers take
+# about 5 MB, 10**5 would take about 465 MB. functools.lru_cache would not help here, because it remembers one
+# result per argument and fib2(100) and fib2(101) share nothing in it.
+
+# The cache is shared by all the threads of the program: if two of them extend
+# it at the same time, their appends mix and the cached series is wrong for
+# ever. A lock makes one thread wait while the other reads or extends it; the
+# numbers over MAX_CACHED are computed outside the lock, in a list of our own.
+
+# Add to fibo.py:
+
+import bisect, mmap, os, threading
+
+MAX_CACHED = 10000           # at most about 5 MB of cached numbers
+_series = [0, 1]             # the cached prefix of the Fibonacci series
+_lock = threading.Lock()     # held while _series is read or changed
+
+def fib2(n):   # return Fibonacci series up to n, using the cache
+    with _lock:
+        if _series[-1] >= n:                       # already cached, just cut it
+            return _series[:bisect.bisect_left(_series, n, 1)] if n > 0 else []
+        a, b = _series[-2], _series[-1]
+        while len(_series) < MAX_CACHED and b < n:  # extend the cached prefix
+            a, b = b, a+b
+            _series.append(b)
+        if b >= n:
+            return _series[:bisect.bisect_left(_series, n, 1)]
+        result = _series[:]                         # over the bound: don't store
+    a, b = b, a+b
+    while b < n:
+        result.append(b)
+        a, b = b, a+b
+    return result
+
+def clear_cache():
+    with _lock:
+        del _series[2:]
+
+# The 1 is twice in the series (0, 1, 1, 2, ...), this is why bisect starts from
+# position 1: in the rest of the list the numbers are strictly increasing.
+
+fibo.fib2(100)    # computes and caches up to 144
+fibo.fib2(50)     # no additions at all, a slice of the cache
+fibo.fib2(1000)   # continues from 89, 144
+
+# Let's check it with 8 threads that extend the cache at the same time, and a
+# series computed without the cache:
+
+import threading
+
+def plain_fib2(n):
+    result = []
+    a, b = 0, 1
+    while a < n:
+        result.append(a)
+        a, b = b, a+b
+    return result
+
+fibo.clear_cache()
+results = []
+threads = [threading.Thread(target=lambda n=n: results.append(fibo.fib2(10**n)))
+           for n in range(200, 1000, 100)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert sorted(results, key=len) == [plain_fib2(10**n) for n in range(200, 1000, 100)]
+assert fibo.fib2(10**1200) == plain_fib2(10**1200)    # the cache is still right
+
+# The cache can also survive a restart of the program. save_cache() writes the
+# numbers to a binary file (for every number, 4 bytes with its length and then
+# its bytes), and load_cache() maps the file in memory with mmap, so the
+# numbers are decoded directly from the file, without reading it first into a
+# bytes object as big as the file. Every number is decoded at once, though:
+# the cache must be a list for bisect. A file cut or damaged must not fill the
+# cache with wrong numbers (fib2() would then loop forever on a series that
+# doesn't grow), so load_cache() checks the length of every record, the count,
+# and the Fibonacci rule on the numbers, and changes nothing if any check
+# fails:
+
+def save_cache(path):
+    with _lock:
+        series = _series[:]
+    with open(path, 'wb') as file:
+        file.write(len(series).to_bytes(8, 'little'))
+        for number in series:
+            data = number.to_bytes((number.bit_length() + 7) // 8, 'little')
+            file.write(len(data).to_bytes(4, 'little'))
+            file.write(data)
+
+def load_cache(path):
+    if not os.path.exists(path) or os.path.getsize(path) < 8:
+        return False
+    with open(path, 'rb') as file, \
+         mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        count = int.from_bytes(data[:8], 'little')
+        numbers = []
+        position = 8
+        for _ in range(count):
+            if position + 4 > len(data):
+                return False                    # the file was cut
+            size = int.from_bytes(data[position:position+4], 'little')
+            position += 4
+            if position + size > len(data):
+                return False
+            if len(numbers) < MAX_CACHED:
+                numbers.append(int.from_bytes(data[position:position+size], 'little'))
+            position += size
+        if position != len(data):
+            return False                        # more data than the count says
+    if numbers[:2] != [0, 1] or any(numbers[k+1] != numbers[k] + numbers[k-1]
+                                    for k in range(1, len(numbers) - 1)):
+        return False                            # not the Fibonacci series
+    with _lock:
+        _series[:] = numbers
+    return True
+
+# Usage:
+
+fibo.fib2(10**1000)               # about 4800 numbers
+fibo.save_cache('fibo_cache.bin')
+
+# and after a restart of the interpreter:
+
+import fibo
+fibo.load_cache('fibo_cache.bin')   # True
+fibo.fib2(10**900)                  # a slice, nothing is computed
+
+# and with a damaged file the cache stays as it is:
+
+import os
+with open('fibo_cache.bin', 'r+b') as file:
+    file.truncate(os.path.getsize('fibo_cache.bin') // 2)
+fibo.load_cache('fibo_cache.bin')   # False
+
+
 ##### 6.1. More on Modules #####
 
 # A module can contain executable statements as well as function definitions. 